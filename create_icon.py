@@ -6,8 +6,28 @@
 设计理念：YouTube红色 + 字幕文本元素
 """
 
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
+import numpy as np
 import os
+import shutil
+
+def _rounded_rect_mask(xx, yy, x0, y0, x1, y1, radius):
+    """圆角矩形的像素掩码（基于到圆角中心的距离）"""
+    cx, cy = (x0 + x1) / 2, (y0 + y1) / 2
+    hw, hh = (x1 - x0) / 2, (y1 - y0) / 2
+    dx = np.clip(np.abs(xx - cx) - hw + radius, 0, None)
+    dy = np.clip(np.abs(yy - cy) - hh + radius, 0, None)
+    return (dx ** 2 + dy ** 2 <= radius * radius) & (np.abs(xx - cx) <= hw) & (np.abs(yy - cy) <= hh)
+
+def _triangle_mask(xx, yy, points):
+    """三角形的像素掩码（三个半平面测试取交集）"""
+    (ax, ay), (bx, by), (cx, cy) = points
+
+    def edge(px, py, qx, qy):
+        return (qx - px) * (yy - py) - (qy - py) * (xx - px)
+
+    d1, d2, d3 = edge(ax, ay, bx, by), edge(bx, by, cx, cy), edge(cx, cy, ax, ay)
+    return ((d1 >= 0) & (d2 >= 0) & (d3 >= 0)) | ((d1 <= 0) & (d2 <= 0) & (d3 <= 0))
 
 def create_app_icon():
     """创建应用图标（多尺寸）"""
@@ -22,74 +42,65 @@ def create_app_icon():
 
     sizes = [1024, 512, 256, 128, 64, 32, 16]  # macOS需要的所有尺寸
 
-    for size in sizes:
-        # 创建图像
-        img = Image.new('RGBA', (size, size), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(img)
-
-        # 计算尺寸参数
-        padding = size // 10
-        corner_radius = size // 8
-
-        # 绘制圆角矩形背景（渐变效果用纯色代替）
-        draw.rounded_rectangle(
-            [(padding, padding), (size - padding, size - padding)],
-            radius=corner_radius,
-            fill=dark_bg
-        )
-
-        # 绘制YouTube播放按钮
-        play_center_x = size // 2
-        play_center_y = size // 2 - size // 8
-        play_size = size // 4
-
-        # YouTube风格的播放按钮（红色圆形）
-        draw.ellipse(
-            [play_center_x - play_size, play_center_y - play_size,
-             play_center_x + play_size, play_center_y + play_size],
-            fill=youtube_red
-        )
-
-        # 白色播放三角形
-        triangle_offset = play_size // 6
-        triangle_points = [
-            (play_center_x - triangle_offset, play_center_y - play_size // 2),
-            (play_center_x - triangle_offset, play_center_y + play_size // 2),
-            (play_center_x + play_size // 2, play_center_y)
-        ]
-        draw.polygon(triangle_points, fill=white)
-
-        # 绘制字幕线条（下方）
-        subtitle_y_start = play_center_y + play_size * 2
-        subtitle_height = size // 30
-        subtitle_gap = size // 40
-
-        # 三行字幕效果
-        for i in range(3):
-            y = subtitle_y_start + i * (subtitle_height + subtitle_gap)
-            # 每行长度不同，模拟真实字幕
-            widths = [0.7, 0.85, 0.6]
-            width_ratio = widths[i]
-            x1 = padding * 2
-            x2 = size - padding * 2
-            line_width = (x2 - x1) * width_ratio
-            x_start = x1 + (x2 - x1 - line_width) / 2
-
-            draw.rounded_rectangle(
-                [(x_start, y), (x_start + line_width, y + subtitle_height)],
-                radius=subtitle_height // 2,
-                fill=subtitle_blue
-            )
-
-        # 保存PNG图像
-        img.save(f'icon_{size}x{size}.png')
-        print(f"✓ 生成 icon_{size}x{size}.png")
+    # 只在最大尺寸上绘制一次，其余尺寸由它缩放得到
+    size = sizes[0]
+    pixels = np.zeros((size, size, 4), dtype=np.uint8)
+    yy, xx = np.ogrid[:size, :size]
+
+    # 计算尺寸参数
+    padding = size // 10
+    corner_radius = size // 8
+
+    # 绘制圆角矩形背景（渐变效果用纯色代替）
+    mask = _rounded_rect_mask(xx, yy, padding, padding,
+                              size - padding, size - padding, corner_radius)
+    pixels[mask] = dark_bg + (255,)
+
+    # 绘制YouTube播放按钮
+    play_center_x = size // 2
+    play_center_y = size // 2 - size // 8
+    play_size = size // 4
+
+    # YouTube风格的播放按钮（红色圆形）
+    mask = (xx - play_center_x) ** 2 + (yy - play_center_y) ** 2 <= play_size * play_size
+    pixels[mask] = youtube_red + (255,)
+
+    # 白色播放三角形
+    triangle_offset = play_size // 6
+    triangle_points = [
+        (play_center_x - triangle_offset, play_center_y - play_size // 2),
+        (play_center_x - triangle_offset, play_center_y + play_size // 2),
+        (play_center_x + play_size // 2, play_center_y)
+    ]
+    pixels[_triangle_mask(xx, yy, triangle_points)] = white + (255,)
+
+    # 绘制字幕线条（下方）
+    subtitle_y_start = play_center_y + play_size * 2
+    subtitle_height = size // 30
+    subtitle_gap = size // 40
+
+    # 三行字幕效果
+    for i in range(3):
+        y = subtitle_y_start + i * (subtitle_height + subtitle_gap)
+        # 每行长度不同，模拟真实字幕
+        widths = [0.7, 0.85, 0.6]
+        width_ratio = widths[i]
+        x1 = padding * 2
+        x2 = size - padding * 2
+        line_width = (x2 - x1) * width_ratio
+        x_start = x1 + (x2 - x1 - line_width) / 2
+
+        mask = _rounded_rect_mask(xx, yy, x_start, y, x_start + line_width,
+                                  y + subtitle_height, subtitle_height // 2)
+        pixels[mask] = subtitle_blue + (255,)
+
+    base = Image.fromarray(pixels)
 
     # 创建iconset目录
     iconset_dir = 'AppIcon.iconset'
     os.makedirs(iconset_dir, exist_ok=True)
 
-    # 复制文件到iconset目录（macOS图标规范）
+    # 各尺寸在iconset中对应的文件名（macOS图标规范）
     icon_mapping = {
         16: ['icon_16x16.png'],
         32: ['icon_16x16@2x.png', 'icon_32x32.png'],
@@ -100,10 +111,26 @@ def create_app_icon():
         1024: ['icon_512x512@2x.png']
     }
 
-    for size, filenames in icon_mapping.items():
-        src = f'icon_{size}x{size}.png'
-        for dest in filenames:
-            os.system(f'cp {src} {iconset_dir}/{dest}')
+    for size in sizes:
+        img = base if size == base.width else base.resize((size, size), Image.LANCZOS)
+
+        # 直接保存到iconset目录的第一个文件名，其余同尺寸文件名用硬链接
+        src, *aliases = [os.path.join(iconset_dir, name) for name in icon_mapping[size]]
+
+        # 保存PNG图像：小尺寸用最快的压缩级别，只有最大尺寸保留默认压缩以控制.icns体积
+        img.save(src, 'PNG', compress_level=6 if size == base.width else 1, optimize=False)
+
+        for dest_path in aliases:
+            # 重复运行时先移除旧文件，避免链接到自身或链接失败
+            if os.path.lexists(dest_path):
+                os.remove(dest_path)
+            try:
+                os.link(src, dest_path)
+            except OSError:
+                # 不支持硬链接的文件系统退回到复制
+                shutil.copyfile(src, dest_path)
+
+        print(f"✓ 生成 {', '.join(icon_mapping[size])}")
 
     print(f"\n✓ iconset目录创建完成: {iconset_dir}")
     print("✓ 所有图标文件已生成")
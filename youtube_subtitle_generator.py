@@ -17,10 +17,109 @@ import re
 import shutil
 from pathlib import Path
 from datetime import datetime
+from functools import lru_cache, partial
 import queue
-
+import collections
+import codecs
+import selectors
+import time
+import hashlib
+import mmap
+import platform
+import signal
+import socket
+import struct
+import tempfile
+import uuid
+import wave
+import http.client
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import psutil  # 可选依赖，用于准确获取物理核心数
+except ImportError:
+    psutil = None
+
+# 子进程输出的换行符（与 universal_newlines 一致，yt-dlp 的进度行以 \r 结尾）
+_NEWLINE_RE = re.compile(r"\r\n|\r|\n")
+
+# 每次从子进程管道读取的最大字节数（一次读取管道中积压的全部输出）
+_READ_CHUNK_SIZE = 1 << 16
+
+# whisper-cli 输出中需要显示在日志里的行（进度和字幕片段），直接绑定 search 方法
+_LOG_FILTER = re.compile(r"whisper_print_progress|\[").search
+
+# 进度已由进度条显示，日志里只保留每隔这么多个百分点的一条进度
+_LOG_PROGRESS_STEP = 25
+
+# whisper-cli -pp 输出的进度百分比、音频时长和总耗时
+_PROG_RE = re.compile(r"progress\s*=\s*(\d+)%")
+_DURATION_RE = re.compile(r"\(\d+ samples, ([\d.]+) sec\)")
+_RTF_RE = re.compile(r"total time\s*=\s*([\d.]+)\s*ms")
+
+# whisper-cli 的 system_info 行中表示启用了GPU或BLAS加速的后端（新旧两种输出格式）
+_ACCEL_RE = re.compile(r"\b(?:Metal|CUDA|BLAS|Vulkan)\s*:|\b(?:METAL|CUDA|BLAS|COREML|ACCELERATE|VULKAN)\s*=\s*1")
+
+# whisper-cli 输出的字幕片段时间戳，如 [00:01:02.500 --> 00:01:05.000]
+_TS_RE = re.compile(r"\[(\d+:\d+:\d+\.\d+)\s*-->\s*(\d+:\d+:\d+\.\d+)\]")
+
+# 视频页面可以规范化为 watch?v= 形式的YouTube域名，以及路径中带视频ID的页面类型
+_YOUTUBE_HOSTS = {"youtube.com", "www.youtube.com", "m.youtube.com", "music.youtube.com"}
+_YOUTUBE_ID_PATHS = ("shorts", "live", "embed", "v")
+
+# SRT 字幕中的时间戳，如 00:01:02,500
+_SRT_TS_RE = re.compile(r"(\d+):(\d{2}):(\d{2}),(\d{3})")
+
+# ffmpeg silencedetect 输出的静音起止时间，以及需要显示在日志里的错误行
+_SILENCE_RE = re.compile(r"silence_(start|end): (-?[\d.]+)")
+_FFMPEG_ERROR_RE = re.compile(r"\[(?:panic|fatal|error)\] ")
+
+# yt-dlp --print 输出最终文件路径时使用的行首标记
+_FILEPATH_MARKER = "[mp3-path] "
+_FILEPATH_RE = re.compile(re.escape(_FILEPATH_MARKER) + r"(.+)$")
+
+# 同时进行的下载数上限（下载受网络限制，过多会触发YouTube限流）
+MAX_CONCURRENT_DOWNLOADS = 2
+
+# 批量处理本地文件时每个whisper-cli任务使用的线程数
+WHISPER_THREADS_PER_JOB = 4
+
+# 批量处理本地文件时单次whisper-cli调用最多合并的文件数（模型只加载一次）
+WHISPER_BATCH_SIZE = 8
+
+# 单次whisper-cli调用合并的MP3总大小上限：一批文件要先全部解码为临时WAV，
+# 64MB 约为1小时128kbps的音频，解码后的WAV约115MB，长录音较多时不会占满临时目录
+WHISPER_BATCH_MAX_BYTES = 64 << 20
+
+# 访问本机 whisper-server 的opener：不经过 http_proxy 等环境变量中配置的代理
+_LOCAL_OPENER = urllib.request.build_opener(urllib.request.ProxyHandler({}))
+
+# whisper-server 内置首页的标题，用于确认端口上应答的确实是 whisper-server
+_WHISPER_SERVER_TITLE = b"<title>Whisper.cpp Server</title>"
+
+# 可选的量化Whisper模型（从小到大，越小越快）
+WHISPER_MODELS = ["tiny-q5_1", "base-q5_1", "small-q5_1", "small-q4_0"]
+
+# 解码时裁掉首尾静音：低于该音量且持续超过该时长视为静音，两端各保留一小段余量，
+# 裁掉的总时长不足 SILENCE_MIN_TRIM 秒时不值得重写WAV
+SILENCE_THRESHOLD_DB = -45
+SILENCE_MIN_DURATION = 0.5
+SILENCE_MARGIN = 0.2
+SILENCE_MIN_TRIM = 1.0
+
+# 日志框最多显示的行数（超出时删除最早的行，插入开销不随运行时间增长），
+# 以及内存中保留、可通过"保存日志"导出的历史条数
+LOG_MAX_LINES = 5000
+LOG_HISTORY_LINES = 100000
+
+# 字幕缓存目录：按音频内容哈希保存已生成的字幕，改名或重复的音频无需重新转写
+SUBTITLE_CACHE_DIR = Path.home() / ".cache" / "yt-whisper-subs"
+
+@lru_cache(maxsize=None)
 def find_executable(name):
-    """查找可执行文件的完整路径"""
+    """查找可执行文件的完整路径（结果会被缓存，批量处理时不必重复扫描PATH）"""
     # 首先尝试使用 shutil.which
     path = shutil.which(name)
     if path:
@@ -35,12 +134,245 @@ def find_executable(name):
     ]
 
     for path in common_paths:
-        if os.path.exists(path) and os.access(path, os.X_OK):
+        # os.access 对不存在的路径返回False，不必再单独检查是否存在
+        if os.access(path, os.X_OK):
             return path
 
     # 如果都失败，返回名称本身（让系统尝试）
     return name
 
+@lru_cache(maxsize=None)
+def physical_cpu_count():
+    """物理核心数：whisper.cpp 的线程数超过物理核心后性能反而下降"""
+    if psutil is not None:
+        cores = psutil.cpu_count(logical=False)
+        if cores:
+            return cores
+    if platform.system() == "Darwin":
+        try:
+            return int(subprocess.check_output(["sysctl", "-n", "hw.physicalcpu"], text=True))
+        except (OSError, subprocess.CalledProcessError, ValueError):
+            pass
+    # 其他平台按每个物理核心两个超线程估算
+    return max(1, (os.cpu_count() or 2) // 2)
+
+def available_models(models_dir):
+    """模型目录中已下载的ggml模型，目录不存在或为空时返回推荐的量化模型路径"""
+    try:
+        with os.scandir(models_dir) as entries:
+            models = sorted(entry.path for entry in entries
+                            if entry.name.startswith("ggml-") and entry.name.endswith(".bin"))
+    except OSError:
+        models = []
+    return models or [os.path.join(models_dir, f"ggml-{name}.bin") for name in WHISPER_MODELS]
+
+@lru_cache(maxsize=None)
+def whisper_job_layout(whisper_model):
+    """批量转写时的 (并行任务数, 每个任务的线程数)
+
+    小模型单个任务用不满所有核心，拆成多个任务并行；medium/large 模型
+    单个任务已占满内存带宽，只运行一个任务。
+    """
+    cores = physical_cpu_count()
+    name = os.path.basename(whisper_model)
+    if "medium" in name or "large" in name or cores < 2 * WHISPER_THREADS_PER_JOB:
+        return 1, cores
+    return cores // WHISPER_THREADS_PER_JOB, WHISPER_THREADS_PER_JOB
+
+def terminate_process(process):
+    """终止子进程及其派生的进程（如 yt-dlp 启动的 ffmpeg），子进程需以 start_new_session=True 启动
+
+    只终止 yt-dlp 时，仍在运行的 ffmpeg 会继续占用输出管道，读取方要等它转码结束才能收到EOF。
+    """
+    if process.poll() is not None:
+        return
+    if hasattr(os, "killpg"):
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+            return
+        except OSError:
+            pass
+    process.terminate()
+
+def free_local_port():
+    """由系统分配一个当前空闲的本地端口"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def encode_multipart(fields, file_field, file_path, block_size=1 << 20):
+    """构造 multipart/form-data 请求体，返回 (body, content_type, content_length)
+
+    body 是按块生成的迭代器，文件边读边发送，不把整个WAV读进内存。
+    """
+    boundary = uuid.uuid4().hex
+    head = b''.join(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        for name, value in fields.items()
+    ) + (
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; '
+        f'filename="{os.path.basename(file_path)}"\r\nContent-Type: application/octet-stream\r\n\r\n'.encode()
+    )
+    tail = f'\r\n--{boundary}--\r\n'.encode()
+
+    def body():
+        yield head
+        with open(file_path, 'rb') as f:
+            yield from iter(partial(f.read, block_size), b'')
+        yield tail
+
+    length = len(head) + os.path.getsize(file_path) + len(tail)
+    return body(), f'multipart/form-data; boundary={boundary}', length
+
+def nonempty_file(path):
+    """文件存在且非空（只调用一次 stat）"""
+    try:
+        return os.stat(path).st_size > 0
+    except OSError:
+        return False
+
+def canonical_url(url):
+    """把YouTube视频链接规范化为 https://www.youtube.com/watch?v=ID
+
+    去掉 si、t、feature 等跟踪或定位参数，youtu.be 短链接和 shorts 等页面也转换为同一形式，
+    同一个视频以不同形式粘贴时只下载一次；无法识别的链接原样返回。
+    """
+    parsed = urllib.parse.urlparse(url if "://" in url else f"https://{url}")
+    host = (parsed.hostname or "").lower()
+    parts = [part for part in parsed.path.split("/") if part]
+
+    video_id = None
+    if host == "youtu.be" and parts:
+        video_id = parts[0]
+    elif host in _YOUTUBE_HOSTS:
+        if parts == ["watch"]:
+            video_id = urllib.parse.parse_qs(parsed.query).get("v", [None])[0]
+        elif len(parts) >= 2 and parts[0] in _YOUTUBE_ID_PATHS:
+            video_id = parts[1]
+
+    return f"https://www.youtube.com/watch?v={video_id}" if video_id else url
+
+def split_batches(mp3_files, batch_size, max_bytes):
+    """把文件按顺序分成批次 [(起始序号, 文件列表)]，每批最多 batch_size 个文件、
+    总大小不超过 max_bytes（单个文件超过上限时单独一批）"""
+    batches = []
+    start, batch, batch_bytes = 0, [], 0
+    for idx, mp3_file in enumerate(mp3_files):
+        try:
+            size = os.stat(mp3_file).st_size
+        except OSError:
+            size = 0
+        if batch and (len(batch) >= batch_size or batch_bytes + size > max_bytes):
+            batches.append((start, batch))
+            start, batch, batch_bytes = idx, [], 0
+        batch.append(mp3_file)
+        batch_bytes += size
+    if batch:
+        batches.append((start, batch))
+    return batches
+
+def find_mp3_folders(root_directory):
+    """递归查找包含MP3文件的文件夹，返回 {文件夹路径: [MP3路径, ...]}，按路径排序
+
+    一次 os.walk 遍历完成：它基于 os.scandir，条目类型来自目录读取本身，不需要逐个 stat；
+    无权限读取的子文件夹直接跳过。
+    """
+    mp3_by_folder = {}
+    for folder, dirnames, filenames in os.walk(root_directory):
+        mp3s = [os.path.join(folder, name) for name in filenames if name.lower().endswith(".mp3")]
+        if mp3s:
+            mp3_by_folder[folder] = sorted(mp3s)
+    return dict(sorted(mp3_by_folder.items()))
+
+def parse_timestamp(text):
+    """把 hh:mm:ss.mmm 格式的时间戳转换为秒数"""
+    hours, minutes, seconds = text.split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+def shift_srt_timestamps(srt_text, offset):
+    """把SRT字幕中的所有时间戳后移 offset 秒"""
+    def shift(match):
+        hours, minutes, seconds, millis = map(int, match.groups())
+        total = (hours * 3600 + minutes * 60 + seconds) * 1000 + millis + round(offset * 1000)
+        seconds, millis = divmod(total, 1000)
+        minutes, seconds = divmod(seconds, 60)
+        hours, minutes = divmod(minutes, 60)
+        return f"{hours:02d}:{minutes:02d}:{seconds:02d},{millis:03d}"
+    return _SRT_TS_RE.sub(shift, srt_text)
+
+def silence_trim_range(silences, duration):
+    """根据 silencedetect 的静音区间 [(开始, 结束或None)] 计算要保留的 (开始, 结束) 秒数
+
+    只裁掉开头和结尾的静音（中间的静音保留，字幕时间戳只需整体平移），不值得裁剪时返回None。
+    """
+    start, end = 0.0, duration
+    if silences and silences[0][0] <= 0.01 and silences[0][1] is not None:
+        start = max(0.0, silences[0][1] - SILENCE_MARGIN)
+    # 结尾的静音没有 silence_end，或者结束时间就是音频末尾
+    if silences and silences[-1][0] > 0.01 and (silences[-1][1] is None or silences[-1][1] >= duration - 0.01):
+        end = min(duration, silences[-1][0] + SILENCE_MARGIN)
+    if start + (duration - end) < SILENCE_MIN_TRIM or end <= start:
+        return None
+    return start, end
+
+def wav_data_offset(buffer):
+    """WAV文件中音频数据（data块内容）的起始偏移，ffmpeg 会在data块之前写入LIST等块"""
+    pos = 12  # 跳过 RIFF 文件头
+    while pos + 8 <= len(buffer):
+        chunk_id = buffer[pos:pos + 4]
+        size, = struct.unpack_from('<I', buffer, pos + 4)
+        if chunk_id == b'data':
+            return pos + 8
+        # 块按偶数字节对齐
+        pos += 8 + size + (size & 1)
+    raise wave.Error("WAV文件中没有data块")
+
+def wav_duration(path):
+    """WAV文件的实际时长（秒），读不出时返回0"""
+    try:
+        with wave.open(path, 'rb') as reader:
+            return reader.getnframes() / reader.getframerate()
+    except (OSError, EOFError, wave.Error, ZeroDivisionError):
+        return 0
+
+@lru_cache(maxsize=None)
+def whisper_help_text(whisper_bin):
+    """whisper-cli 的帮助信息，用于检测当前版本支持的参数"""
+    try:
+        result = subprocess.run(
+            [whisper_bin, "--help"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            encoding='utf-8',
+            errors='replace',
+            timeout=10
+        )
+        return result.stdout
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+def whisper_accel_args(whisper_bin):
+    """根据平台返回whisper-cli的加速参数"""
+    args = []
+    # Apple Silicon 上 Metal 后端开启 flash attention 明显更快（旧版本不支持该参数）
+    if (platform.system() == "Darwin" and platform.machine() == "arm64"
+            and "--flash-attn" in whisper_help_text(whisper_bin)):
+        args.append("-fa")
+    return args
+
+def subtitle_cache_key(mp3_file, whisper_model):
+    """根据音频内容和模型计算字幕缓存键"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(mp3_file, 'rb') as f:
+        # 使用mmap避免把整个音频文件读入Python内存
+        if os.fstat(f.fileno()).st_size > 0:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                digest.update(data)
+    # 不同模型生成的字幕不同
+    digest.update(os.path.basename(whisper_model).encode('utf-8'))
+    return digest.hexdigest()
+
 class YouTubeSubtitleGenerator:
     def __init__(self, root):
         self.root = root
@@ -70,13 +402,51 @@ class YouTubeSubtitleGenerator:
         self.whisper_model = "/tmp/whisper.cpp/models/ggml-base-q5_1.bin"
 
         # 消息队列，用于线程间通信
-        self.message_queue = queue.Queue()
+        # SimpleQueue 没有 task_done/join 的条件变量开销，工作线程投递消息更轻
+        self.message_queue = queue.SimpleQueue()
+
+        # 日志缓冲区，由主线程定时批量写入日志框
+        self._log_buf = collections.deque()
+        self._log_lock = threading.Lock()
+        # 完整的日志历史（仅主线程访问），日志框只显示最近 LOG_MAX_LINES 行
+        self._log_history = collections.deque(maxlen=LOG_HISTORY_LINES)
+
+        # 已发出但主线程尚未处理的唤醒事件：同一时间最多只有一个在途，
+        # 进度等高频消息不会在Tk事件队列里堆积大量 <<QueueItem>>
+        self._wake_pending = False
+        self._wake_lock = threading.Lock()
+
+        # 是否已检查过whisper-cli的加速后端（每次运行只提示一次）
+        self._accel_checked = False
+
+        # 所有子进程的输出由同一个读取线程通过selector多路复用读取，按需启动
+        self._selector = selectors.DefaultSelector()
+        self._reader_lock = threading.Lock()
+        self._reader_thread = None
+        # 自唤醒管道：登记新的子进程管道时写入一个字节，读取线程可以无超时地阻塞在select上
+        self._reader_wakeup = os.pipe()
+        for fd in self._reader_wakeup:
+            os.set_blocking(fd, False)
+        self._selector.register(self._reader_wakeup[0], selectors.EVENT_READ, data=None)
 
         # 设置样式
         self.setup_styles()
         self.setup_ui()
 
-        # 启动消息处理
+        # 启动时解析一次外部工具的路径，之后每次下载和解码直接使用
+        self.yt_dlp_path = find_executable("yt-dlp")
+        self.ffmpeg_path = find_executable("ffmpeg")
+        self.ffmpeg_dir = os.path.dirname(self.ffmpeg_path) or "/usr/local/bin"
+        # 找不到时 find_executable 返回名称本身
+        self.missing_tools = [
+            name for name, path in (("yt-dlp", self.yt_dlp_path), ("ffmpeg", self.ffmpeg_path))
+            if not os.path.isabs(path)
+        ]
+        for name in self.missing_tools:
+            self.log(f"警告: 未找到 {name}，请先安装（brew install {name}）")
+
+        # 工作线程发送消息时通过虚拟事件唤醒主线程，另有低频定时器兜底
+        self.root.bind('<<QueueItem>>', lambda event: self._drain_queue())
         self.process_messages()
 
     def setup_styles(self):
@@ -115,6 +485,10 @@ class YouTubeSubtitleGenerator:
                        foreground=self.colors['text'],
                        padding=8)
 
+        # 路径无效的输入框用红色文字提示
+        style.configure('Invalid.TEntry', foreground=self.colors['error'])
+        style.configure('Invalid.TCombobox', foreground=self.colors['error'])
+
         # 配置TCheckbutton样式
         style.configure('TCheckbutton',
                        background=self.colors['bg'],
@@ -124,30 +498,69 @@ class YouTubeSubtitleGenerator:
                        background=self.colors['white'])
 
     def process_messages(self):
-        """处理来自工作线程的消息"""
+        """定时兜底处理消息（正常情况下由 <<QueueItem>> 事件即时触发）"""
+        self._drain_queue()
+
+        # 每秒检查一次，防止遗漏唤醒事件
+        self.root.after(1000, self.process_messages)
+
+    def _drain_queue(self):
+        """处理来自工作线程的消息
+
+        状态和进度只保留本次取出的最后一个值，一次处理只重绘一次；
+        提示框放在最后弹出，避免在状态更新之前阻塞。
+        """
+        # 先清除标记再取消息：此后投递的消息会发出新的唤醒事件，不会被遗漏
+        self._wake_pending = False
+        status = progress = None
+        messages = []
         try:
             while True:
                 msg_type, msg_data = self.message_queue.get_nowait()
-                if msg_type == 'log':
-                    self._do_log(msg_data)
-                elif msg_type == 'status':
-                    self._do_update_status(msg_data['text'], msg_data['color'])
-                elif msg_type == 'progress_start':
-                    self.progress.start()
+                if msg_type == 'status':
+                    status = msg_data
+                elif msg_type == 'progress_set':
+                    progress = msg_data
                 elif msg_type == 'progress_stop':
-                    self.progress.stop()
+                    progress = 0
                 elif msg_type == 'button_state':
                     if msg_data['button'] == 'start':
                         self.start_button.config(state=msg_data['state'])
                     elif msg_data['button'] == 'stop':
                         self.stop_button.config(state=msg_data['state'])
                 elif msg_type == 'messagebox':
-                    messagebox.showinfo(msg_data['title'], msg_data['message'])
+                    messages.append(msg_data)
         except queue.Empty:
             pass
 
-        # 每100ms检查一次队列
-        self.root.after(100, self.process_messages)
+        if status is not None:
+            self._do_update_status(status['text'], status['color'])
+        if progress is not None:
+            self.progress['value'] = progress
+
+        # 批量写入日志
+        self._drain_log()
+
+        for msg_data in messages:
+            messagebox.showinfo(msg_data['title'], msg_data['message'])
+
+    def post_message(self, msg_type, msg_data=None):
+        """向主线程发送消息(线程安全)"""
+        self.message_queue.put((msg_type, msg_data))
+        self._wake_ui()
+
+    def _wake_ui(self):
+        """通知主线程立即处理消息，空闲时不再需要定时轮询"""
+        with self._wake_lock:
+            # 已有唤醒事件在途，主线程处理时会一并取出新消息
+            if self._wake_pending:
+                return
+            self._wake_pending = True
+        try:
+            self.root.event_generate('<<QueueItem>>', when='tail')
+        except (tk.TclError, RuntimeError):
+            # 窗口已关闭或主循环尚未运行，由定时器兜底；清除标记，下一条消息会重新尝试唤醒
+            self._wake_pending = False
 
     def setup_ui(self):
         # 主框架
@@ -202,10 +615,20 @@ class YouTubeSubtitleGenerator:
         self.whisper_bin_entry.grid(row=3, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
 
         ttk.Label(config_frame, text="Whisper模型:").grid(row=4, column=0, sticky=tk.W, pady=5)
-        self.whisper_model_entry = ttk.Entry(config_frame, width=50)
+        self.whisper_model_entry = ttk.Combobox(
+            config_frame, width=48,
+            values=available_models(os.path.dirname(self.whisper_model))
+        )
         self.whisper_model_entry.insert(0, self.whisper_model)
         self.whisper_model_entry.grid(row=4, column=1, sticky=(tk.W, tk.E), padx=5, pady=5)
 
+        # 输入框失去焦点或选择模型时检查路径并缓存结果，点击开始时无需再访问文件系统
+        self._whisper_config = (None, None, False, False)
+        self.whisper_bin_entry.bind("<FocusOut>", self._revalidate)
+        self.whisper_model_entry.bind("<FocusOut>", self._revalidate)
+        self.whisper_model_entry.bind("<<ComboboxSelected>>", self._revalidate)
+        self._revalidate()
+
         # 按钮区域
         button_frame = ttk.Frame(main_frame)
         button_frame.grid(row=3, column=0, columnspan=3, pady=10)
@@ -224,8 +647,12 @@ class YouTubeSubtitleGenerator:
         ttk.Button(button_frame, text="清空日志",
                   command=self.clear_log).grid(row=0, column=3, padx=5)
 
+        ttk.Button(button_frame, text="保存日志",
+                  command=self.save_log).grid(row=0, column=4, padx=5)
+
         # 进度条
-        self.progress = ttk.Progressbar(main_frame, mode='indeterminate')
+        # 进度条显示当前文件的字幕生成进度
+        self.progress = ttk.Progressbar(main_frame, mode='determinate', maximum=100)
         self.progress.grid(row=4, column=0, columnspan=3, sticky=(tk.W, tk.E), pady=5)
 
         # 状态标签
@@ -248,8 +675,22 @@ class YouTubeSubtitleGenerator:
         log_frame.columnconfigure(0, weight=1)
         log_frame.rowconfigure(0, weight=1)
 
-        self.processing = False
-        self.process = None
+        # 停止信号，所有工作线程共享；开始处理时清除，停止时设置
+        self.stop_event = threading.Event()
+        # 正在运行的子进程（下载和字幕生成并行进行），停止时统一终止
+        self.processes = set()
+
+        # 常驻的 whisper-server，首次转写下载的视频时按需启动，关闭窗口时退出
+        self._server_lock = threading.Lock()
+        self._server_process = None
+        self._server_key = None
+        self._server_url = None
+        # 本批次中启动失败的 (程序, 模型)，同一批次内不再重复尝试
+        self._server_failed = None
+        self._server_busy = False
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        # macOS 上 Cmd-Q 和菜单"退出"不经过 WM_DELETE_WINDOW
+        self.root.createcommand('::tk::mac::Quit', self.on_close)
 
     def browse_output_dir(self):
         directory = filedialog.askdirectory()
@@ -268,30 +709,98 @@ class YouTubeSubtitleGenerator:
 
     def log(self, message):
         """添加日志消息(线程安全)"""
-        self.message_queue.put(('log', message))
-
-    def _do_log(self, message):
-        """实际执行日志添加(仅在主线程)"""
         timestamp = datetime.now().strftime("%H:%M:%S")
-        self.log_text.config(state=tk.NORMAL)
-        self.log_text.insert(tk.END, f"[{timestamp}] {message}\n")
-        self.log_text.see(tk.END)
-        self.log_text.config(state=tk.DISABLED)
+        with self._log_lock:
+            # 缓冲区为空时才需要唤醒主线程，之后的日志会在同一次刷新中一并写入
+            wake = not self._log_buf
+            self._log_buf.append((timestamp, message))
+        if wake:
+            self._wake_ui()
+
+    def _drain_log(self):
+        """批量写入缓冲的日志(仅在主线程)"""
+        with self._log_lock:
+            pending = list(self._log_buf)
+            self._log_buf.clear()
+
+        if pending:
+            lines = [f"[{timestamp}] {message}\n" for timestamp, message in pending]
+            self._log_history.extend(lines)
+            self.log_text.config(state=tk.NORMAL)
+            self.log_text.insert(tk.END, "".join(lines))
+            # 只保留最近的行，避免日志框无限增长
+            self.log_text.delete('1.0', f'end-{LOG_MAX_LINES} lines')
+            self.log_text.see(tk.END)
+            self.log_text.config(state=tk.DISABLED)
 
     def clear_log(self):
         """清空日志"""
+        self._log_history.clear()
         self.log_text.config(state=tk.NORMAL)
         self.log_text.delete(1.0, tk.END)
         self.log_text.config(state=tk.DISABLED)
 
+    def save_log(self):
+        """把日志历史（包括日志框中已删除的行）保存到文件"""
+        # 先写入尚未刷新到日志框的日志
+        self._drain_log()
+        filename = filedialog.asksaveasfilename(
+            title="保存日志",
+            defaultextension=".txt",
+            initialfile=f"subtitle-log-{datetime.now():%Y%m%d-%H%M%S}.txt",
+            filetypes=[("Text files", "*.txt"), ("All files", "*.*")]
+        )
+        if not filename:
+            return
+        try:
+            with open(filename, 'w', encoding='utf-8') as f:
+                f.writelines(self._log_history)
+        except OSError as e:
+            messagebox.showwarning("警告", f"无法保存日志: {str(e)}")
+
     def update_status(self, message, color="black"):
         """更新状态标签(线程安全)"""
-        self.message_queue.put(('status', {'text': message, 'color': color}))
+        self.post_message('status', {'text': message, 'color': color})
+
+    def update_progress(self, percent):
+        """更新进度条(线程安全)"""
+        self.post_message('progress_set', percent)
 
     def _do_update_status(self, text, color):
         """实际更新状态(仅在主线程)"""
         self.status_label.config(text=text, foreground=color)
 
+    def _revalidate(self, event=None):
+        """检查Whisper程序和模型路径，返回 (程序, 模型, 程序有效, 模型有效)
+
+        路径未改变且都有效时直接使用缓存的结果；无效时每次重新检查，
+        以便用户补上文件后不必修改路径。无效的输入框文字显示为红色。
+        """
+        whisper_bin = self.whisper_bin_entry.get().strip()
+        whisper_model = self.whisper_model_entry.get().strip()
+        cached_bin, cached_model, bin_ok, model_ok = self._whisper_config
+        if (cached_bin, cached_model) == (whisper_bin, whisper_model) and bin_ok and model_ok:
+            return self._whisper_config
+
+        bin_ok = os.path.isfile(whisper_bin)
+        # 同时排除下载中断留下的空模型文件
+        model_ok = nonempty_file(whisper_model)
+        self._whisper_config = (whisper_bin, whisper_model, bin_ok, model_ok)
+        self.whisper_bin_entry.configure(style='TEntry' if bin_ok else 'Invalid.TEntry')
+        self.whisper_model_entry.configure(style='TCombobox' if model_ok else 'Invalid.TCombobox')
+        return self._whisper_config
+
+    def _check_whisper_config(self):
+        """验证Whisper配置，有效时返回 (程序, 模型)，否则提示并返回None"""
+        whisper_bin, whisper_model, bin_ok, model_ok = self._revalidate()
+        if not bin_ok:
+            messagebox.showwarning("警告", f"Whisper程序不存在: {whisper_bin}")
+            return None
+        if not model_ok:
+            messagebox.showwarning("警告", f"Whisper模型不存在或为空: {whisper_model}")
+            return None
+        return whisper_bin, whisper_model
+
     def process_local_mp3(self):
         """处理本地MP3文件"""
         # 让用户选择包含MP3文件的文件夹
@@ -299,16 +808,9 @@ class YouTubeSubtitleGenerator:
         if not root_directory:
             return
 
-        # 获取所有子文件夹（包括当前文件夹）
-        root_path = Path(root_directory)
-        subdirs = [root_path] + [d for d in root_path.rglob("*") if d.is_dir()]
-
-        # 筛选包含MP3文件的文件夹
-        folders_with_mp3 = []
-        for folder in subdirs:
-            mp3_count = len(list(folder.glob("*.mp3")))
-            if mp3_count > 0:
-                folders_with_mp3.append((folder, mp3_count))
+        # 一次遍历找出所有包含MP3文件的文件夹（包括当前文件夹）
+        mp3_by_folder = {Path(folder): files for folder, files in find_mp3_folders(root_directory).items()}
+        folders_with_mp3 = [(folder, len(files)) for folder, files in mp3_by_folder.items()]
 
         if not folders_with_mp3:
             messagebox.showwarning("警告", f"在 {root_directory} 及其子文件夹中没有找到MP3文件")
@@ -320,28 +822,28 @@ class YouTubeSubtitleGenerator:
             return
 
         # 验证配置
-        whisper_bin = self.whisper_bin_entry.get().strip()
-        if not os.path.exists(whisper_bin):
-            messagebox.showwarning("警告", f"Whisper程序不存在: {whisper_bin}")
+        config = self._check_whisper_config()
+        if not config:
             return
-
-        whisper_model = self.whisper_model_entry.get().strip()
-        if not os.path.exists(whisper_model):
-            messagebox.showwarning("警告", f"Whisper模型不存在: {whisper_model}")
+        whisper_bin, whisper_model = config
+
+        # 收集选中文件夹中的所有MP3文件，已有字幕的文件在这里就跳过
+        all_mp3s = [mp3 for folder in selected_folders for mp3 in mp3_by_folder[folder]]
+        mp3_files = [Path(mp3) for mp3 in all_mp3s if not nonempty_file(f"{mp3}.srt")]
+        skipped = len(all_mp3s) - len(mp3_files)
+
+        self.log(f"从 {len(selected_folders)} 个文件夹中找到 {len(all_mp3s)} 个MP3文件")
+        if skipped:
+            self.log(f"其中 {skipped} 个已有字幕，跳过")
+        if not mp3_files:
+            messagebox.showinfo("完成", "选中的MP3文件都已有字幕")
             return
 
-        # 收集选中文件夹中的所有MP3文件
-        mp3_files = []
-        for folder in selected_folders:
-            mp3_files.extend(list(folder.glob("*.mp3")))
-
-        self.log(f"从 {len(selected_folders)} 个文件夹中找到 {len(mp3_files)} 个MP3文件")
-
         # 开始处理
-        self.processing = True
+        self.stop_event.clear()
         self.start_button.config(state=tk.DISABLED)
         self.stop_button.config(state=tk.NORMAL)
-        self.progress.start()
+        self.progress['value'] = 0
 
         # 在新线程中处理
         thread = threading.Thread(target=self.process_local_mp3_files, args=(mp3_files, whisper_bin, whisper_model))
@@ -426,57 +928,104 @@ class YouTubeSubtitleGenerator:
         return selected_folders
 
     def process_local_mp3_files(self, mp3_files, whisper_bin, whisper_model):
-        """批量处理本地MP3文件"""
+        """批量处理本地MP3文件（多个whisper-cli任务并行）"""
         total = len(mp3_files)
         success_count = 0
 
-        for idx, mp3_file in enumerate(mp3_files, 1):
-            if not self.processing:
-                break
+        jobs, threads = whisper_job_layout(whisper_model)
+        if jobs > 1:
+            self.log(f"并行运行 {jobs} 个whisper任务，每个任务 {threads} 个线程")
+
+        # 多个文件合并到一次whisper-cli调用中，省去每个文件重复加载模型；
+        # 同时保证每个并行任务都能分到文件，并按大小限制每批需要同时解码的音频
+        batch_size = max(1, min(WHISPER_BATCH_SIZE, -(-total // jobs)))
+        batches = split_batches(mp3_files, batch_size, WHISPER_BATCH_MAX_BYTES)
+
+        # 整体进度：各批次按文件数加权汇总whisper输出的进度，多个任务并行时也能连续推进，
+        # 只在整体百分比增加时才通知界面
+        batch_progress = {}
+        progress_lock = threading.Lock()
+        shown_percent = 0
+
+        def report_progress(start, size, percent):
+            nonlocal shown_percent
+            with progress_lock:
+                batch_progress[start] = percent * size
+                overall = sum(batch_progress.values()) // total
+                if overall <= shown_percent:
+                    return
+                shown_percent = overall
+            self.update_progress(overall)
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                executor.submit(self._process_local_mp3, start + 1, total, batch,
+                                whisper_bin, whisper_model, threads,
+                                partial(report_progress, start, len(batch))): (start, len(batch))
+                for start, batch in batches
+            }
+
+            done = 0
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue
+                start, size = futures[future]
+                done += size
+                success_count += future.result()
+                # 已有字幕或命中缓存的批次不会输出进度
+                report_progress(start, size, 100)
+                if jobs > 1:
+                    self.update_status(f"已完成 {done}/{total}", "blue")
+
+                if self.stop_event.is_set():
+                    # 停止后取消尚未开始的任务
+                    for pending in futures:
+                        pending.cancel()
 
-            mp3_path = str(mp3_file)
-            self.update_status(f"处理 {idx}/{total}: {mp3_file.name}", "blue")
+        # 完成
+        self.post_message('progress_stop')
+        self.post_message('button_state', {'button': 'start', 'state': tk.NORMAL})
+        self.post_message('button_state', {'button': 'stop', 'state': tk.DISABLED})
+
+        if not self.stop_event.is_set():
+            self.update_status(f"完成！成功: {success_count}/{total}", "green")
             self.log(f"\n{'='*60}")
+            self.log(f"全部完成！成功处理 {success_count}/{total} 个文件")
+            self.post_message('messagebox', {'title': '完成', 'message': f"成功处理 {success_count}/{total} 个MP3文件"})
+
+    def _process_local_mp3(self, first_idx, total, mp3_files, whisper_bin, whisper_model, threads, on_progress):
+        """处理一批本地MP3文件（在线程池中运行），返回成功的文件数"""
+        if self.stop_event.is_set():
+            return 0
+
+        last_idx = first_idx + len(mp3_files) - 1
+        self.update_status(f"处理 {first_idx}-{last_idx}/{total}: {mp3_files[0].name}", "blue")
+        self.log(f"\n{'='*60}")
+        for idx, mp3_file in enumerate(mp3_files, first_idx):
             self.log(f"处理第 {idx}/{total} 个文件: {mp3_file.name}")
 
-            try:
-                # 生成字幕
-                self.log("生成字幕...")
-                srt_file = self.generate_subtitle(mp3_path, whisper_bin, whisper_model)
+        try:
+            # 生成字幕
+            self.log("生成字幕...")
+            results = self.generate_subtitles([str(mp3_file) for mp3_file in mp3_files],
+                                              whisper_bin, whisper_model, threads, on_progress)
 
+            for mp3_file, srt_file in results.items():
                 if srt_file:
                     self.log(f"✓ 字幕生成完成: {os.path.basename(srt_file)}")
-                    success_count += 1
                 else:
-                    self.log("✗ 字幕生成失败")
+                    self.log(f"✗ 字幕生成失败: {os.path.basename(mp3_file)}")
+            return sum(1 for srt_file in results.values() if srt_file)
 
-            except Exception as e:
-                self.log(f"✗ 处理失败: {str(e)}")
-
-        # 完成
-        self.message_queue.put(('progress_stop', None))
-        self.message_queue.put(('button_state', {'button': 'start', 'state': tk.NORMAL}))
-        self.message_queue.put(('button_state', {'button': 'stop', 'state': tk.DISABLED}))
-
-        if self.processing:
-            self.update_status(f"完成！成功: {success_count}/{total}", "green")
-            self.log(f"\n{'='*60}")
-            self.log(f"全部完成！成功处理 {success_count}/{total} 个文件")
-            self.message_queue.put(('messagebox', {'title': '完成', 'message': f"成功处理 {success_count}/{total} 个MP3文件"}))
+        except Exception as e:
+            self.log(f"✗ 处理失败: {str(e)}")
+        return 0
 
     def start_processing(self):
         """开始处理"""
-        # 获取URL列表
-        urls = []
-        single_url = self.url_entry.get().strip()
-        if single_url:
-            urls.append(single_url)
-
-        batch_urls = self.url_text.get("1.0", tk.END).strip().split("\n")
-        for url in batch_urls:
-            url = url.strip()
-            if url and url not in urls:
-                urls.append(url)
+        # 获取URL列表（规范化后用 dict.fromkeys 去重并保持顺序，单个URL输入框排在最前）
+        lines = [self.url_entry.get(), *self.url_text.get("1.0", tk.END).splitlines()]
+        urls = list(dict.fromkeys(canonical_url(url) for url in map(str.strip, lines) if url))
 
         if not urls:
             messagebox.showwarning("警告", "请输入至少一个YouTube URL")
@@ -488,217 +1037,845 @@ class YouTubeSubtitleGenerator:
             messagebox.showwarning("警告", "请选择输出目录")
             return
 
-        whisper_bin = self.whisper_bin_entry.get().strip()
-        if not os.path.exists(whisper_bin):
-            messagebox.showwarning("警告", f"Whisper程序不存在: {whisper_bin}")
+        # 下载和转码需要的工具在启动时已解析，缺少时提前提示，而不是每个URL都失败一次
+        if self.missing_tools:
+            messagebox.showwarning(
+                "警告", f"未找到 {'、'.join(self.missing_tools)}，请先安装：brew install {' '.join(self.missing_tools)}")
             return
 
-        whisper_model = self.whisper_model_entry.get().strip()
-        if not os.path.exists(whisper_model):
-            messagebox.showwarning("警告", f"Whisper模型不存在: {whisper_model}")
+        if not self._check_whisper_config():
             return
 
         # 开始处理 - 直接操作UI（这是在主线程中）
-        self.processing = True
+        self.stop_event.clear()
         self.start_button.config(state=tk.DISABLED)
         self.stop_button.config(state=tk.NORMAL)
-        self.progress.start()
+        self.progress['value'] = 0
 
         # 在新线程中处理
         thread = threading.Thread(target=self.process_urls, args=(urls,))
         thread.daemon = True
         thread.start()
 
+    def on_close(self):
+        """关闭窗口：停止所有处理后退出"""
+        self.shutdown()
+        self.root.destroy()
+
+    def shutdown(self):
+        """通知工作线程停止，终止正在运行的子进程和常驻的 whisper-server（可重复调用）"""
+        self.stop_event.set()
+        for process in list(self.processes):
+            terminate_process(process)
+        self._stop_whisper_server()
+
     def stop_processing(self):
         """停止处理 - 这是在主线程中调用的"""
-        self.processing = False
-        if self.process:
-            self.process.terminate()
+        self.stop_event.set()
+        for process in list(self.processes):
+            terminate_process(process)
+        # 无法单独取消正在处理的HTTP请求，只能终止服务，下次转写时会重新启动
+        if self._server_busy:
+            self._stop_whisper_server()
         self.update_status("已停止", "red")
         self.log("用户停止了处理")
         # 直接操作UI（这是在主线程中）
         self.start_button.config(state=tk.NORMAL)
         self.stop_button.config(state=tk.DISABLED)
-        self.progress.stop()
+        self.progress['value'] = 0
 
     def process_urls(self, urls):
         """处理URL列表"""
         output_dir = self.output_dir_entry.get().strip()
         cookies_file = self.cookies_entry.get().strip()
-        use_cookies = self.use_cookies_var.get()
         whisper_bin = self.whisper_bin_entry.get().strip()
         whisper_model = self.whisper_model_entry.get().strip()
 
+        # 上一批次中启动失败的whisper-server可能已经修复，重新尝试
+        self._server_failed = None
+
+        # 整个批次只检查一次cookies文件
+        use_cookies = self.use_cookies_var.get() and self._validate_cookies(cookies_file)
+
         # 确保输出目录存在
         os.makedirs(output_dir, exist_ok=True)
 
         total = len(urls)
-        success_count = 0
 
-        for idx, url in enumerate(urls, 1):
-            if not self.processing:
-                break
+        # 下载（网络）与字幕生成（CPU）流水线并行：
+        # 下载线程池并发下载，把完成的MP3放入有界队列，字幕线程依次取出生成字幕
+        mp3_queue = queue.Queue(maxsize=2)
+        srt_files = []
 
-            self.update_status(f"处理 {idx}/{total}: {url}", "blue")
+        transcriber = threading.Thread(
+            target=self._transcriber_worker,
+            args=(mp3_queue, total, whisper_bin, whisper_model, srt_files)
+        )
+        transcriber.daemon = True
+        transcriber.start()
+
+        # 限制同时进行的下载数，避免触发YouTube限流
+        with ThreadPoolExecutor(max_workers=min(MAX_CONCURRENT_DOWNLOADS, total)) as executor:
+            futures = [
+                executor.submit(self._download_one, idx, total, url, mp3_queue,
+                                output_dir, cookies_file, use_cookies)
+                for idx, url in enumerate(urls, 1)
+            ]
+            # 线程池会吞掉任务中未捕获的异常（如解码时创建临时文件失败），需要取出来记录
+            for future in as_completed(futures):
+                if future.exception() is not None:
+                    self.log(f"✗ 下载失败: {str(future.exception())}")
+        # 所有下载结束后放入结束标记
+        mp3_queue.put(None)
+        transcriber.join()
+
+        success_count = len(srt_files)
+
+        # 完成
+        self.post_message('progress_stop')
+        self.post_message('button_state', {'button': 'start', 'state': tk.NORMAL})
+        self.post_message('button_state', {'button': 'stop', 'state': tk.DISABLED})
+
+        if not self.stop_event.is_set():
+            self.update_status(f"完成！成功: {success_count}/{total}", "green")
             self.log(f"\n{'='*60}")
-            self.log(f"处理第 {idx}/{total} 个视频: {url}")
+            self.log(f"全部完成！成功处理 {success_count}/{total} 个视频")
+            self.post_message('messagebox', {'title': '完成', 'message': f"成功处理 {success_count}/{total} 个视频"})
 
-            try:
-                # 步骤1: 下载MP3
-                self.log("步骤1: 下载音频...")
-                mp3_file = self.download_audio(url, output_dir, cookies_file, use_cookies)
+    def _validate_cookies(self, cookies_file):
+        """检查cookies文件是否为yt-dlp可用的Netscape格式，不可用时记录原因并返回False"""
+        try:
+            with open(cookies_file, encoding='utf-8', errors='replace') as f:
+                lines = f.read().splitlines()
+        except OSError as e:
+            self.log(f"注意: 无法读取Cookies文件，将不使用Cookies: {str(e)}")
+            return False
+
+        if not lines or not lines[0].startswith(("# Netscape HTTP Cookie File", "# HTTP Cookie File")):
+            self.log("注意: Cookies文件不是Netscape格式（缺少 '# Netscape HTTP Cookie File' 文件头），将不使用Cookies")
+            return False
+
+        entries = sum(1 for line in lines
+                      if line.strip() and (not line.startswith("#") or line.startswith("#HttpOnly_")))
+        if not entries:
+            self.log("注意: Cookies文件中没有任何cookie，将不使用Cookies")
+            return False
+
+        self.log(f"使用Cookies文件: {cookies_file}（{entries} 条cookie）")
+        return True
+
+    def _download_one(self, idx, total, url, mp3_queue, output_dir, cookies_file, use_cookies):
+        """流水线下载阶段（在线程池中运行）：下载并解码，把 (序号, MP3路径, WAV路径) 放入队列
+
+        WAV 解码在下载线程中完成，与上一个文件的转写重叠；已有字幕或解码失败时为None，
+        否则为 _decode_audio 返回的 (WAV路径, 裁掉的开头秒数)。
+        """
+        # 停止后尚未开始的下载直接跳过
+        if self.stop_event.is_set():
+            return
 
-                if not mp3_file or not self.processing:
-                    continue
+        self.update_status(f"下载 {idx}/{total}: {url}", "blue")
+        self.log(f"\n{'='*60}")
+        self.log(f"下载第 {idx}/{total} 个视频: {url}")
+
+        try:
+            mp3_file = self.download_audio(url, output_dir, cookies_file, use_cookies)
+        except Exception as e:
+            self.log(f"✗ 下载失败: {str(e)}")
+            return
 
-                self.log(f"✓ 下载完成: {os.path.basename(mp3_file)}")
+        if not mp3_file or self.stop_event.is_set():
+            return
+
+        self.log(f"✓ 下载完成: {os.path.basename(mp3_file)}")
+        decoded = None if nonempty_file(f"{mp3_file}.srt") else self._decode_audio(mp3_file)
+        mp3_queue.put((idx, mp3_file, decoded))
 
-                # 步骤2: 生成字幕
-                self.log("步骤2: 生成字幕...")
-                srt_file = self.generate_subtitle(mp3_file, whisper_bin, whisper_model)
+    def _transcriber_worker(self, mp3_queue, total, whisper_bin, whisper_model, srt_files):
+        """流水线字幕阶段：从队列取出MP3生成字幕，成功的字幕文件追加到 srt_files"""
+        while True:
+            item = mp3_queue.get()
+            if item is None:
+                break
+            idx, mp3_file, decoded = item
+            # 停止后继续取出队列中的项目，避免下载线程阻塞在put上
+            if self.stop_event.is_set():
+                if decoded:
+                    os.remove(decoded[0])
+                continue
+
+            self.update_status(f"生成字幕 {idx}/{total}: {os.path.basename(mp3_file)}", "blue")
+            self.log(f"生成字幕 ({idx}/{total}): {os.path.basename(mp3_file)}")
+
+            try:
+                srt_file = self.generate_subtitle(mp3_file, whisper_bin, whisper_model,
+                                                  on_progress=self.update_progress, decoded=decoded)
 
                 if srt_file:
                     self.log(f"✓ 字幕生成完成: {os.path.basename(srt_file)}")
-                    success_count += 1
+                    srt_files.append(srt_file)
                 else:
                     self.log("✗ 字幕生成失败")
 
             except Exception as e:
                 self.log(f"✗ 处理失败: {str(e)}")
 
-        # 完成
-        self.message_queue.put(('progress_stop', None))
-        self.message_queue.put(('button_state', {'button': 'start', 'state': tk.NORMAL}))
-        self.message_queue.put(('button_state', {'button': 'stop', 'state': tk.DISABLED}))
-
-        if self.processing:
-            self.update_status(f"完成！成功: {success_count}/{total}", "green")
-            self.log(f"\n{'='*60}")
-            self.log(f"全部完成！成功处理 {success_count}/{total} 个视频")
-            self.message_queue.put(('messagebox', {'title': '完成', 'message': f"成功处理 {success_count}/{total} 个视频"}))
-
     def download_audio(self, url, output_dir, cookies_file, use_cookies):
-        """下载YouTube音频为MP3"""
+        """下载YouTube音频为MP3（yt-dlp 和 ffmpeg 的路径在启动时已解析）"""
         try:
-            # 查找yt-dlp的完整路径
-            yt_dlp_path = find_executable("yt-dlp")
-
-            # 查找ffmpeg的完整路径
-            ffmpeg_path = find_executable("ffmpeg")
-            ffmpeg_dir = os.path.dirname(ffmpeg_path) if ffmpeg_path else "/usr/local/bin"
-
+            output_template = f"{output_dir}/%(title)s.%(ext)s"
             cmd = [
-                yt_dlp_path,
+                self.yt_dlp_path,
                 "-x",  # 仅提取音频
                 "--audio-format", "mp3",
-                "--ffmpeg-location", ffmpeg_dir,  # 指定ffmpeg位置
-                "-o", f"{output_dir}/%(title)s.%(ext)s"
+                "--ffmpeg-location", self.ffmpeg_dir,  # 指定ffmpeg位置
+                # 输出带标记的最终文件路径，按标记匹配即可，无需扫描目录或逐行检查文件
+                "--print", f"after_move:{_FILEPATH_MARKER}%(filepath)s",
+                "--no-quiet",  # --print 默认会静默其他输出，保留下载日志
+                "--no-simulate",
+                # 记录已下载的视频ID，重复运行时直接跳过下载和转码
+                "--download-archive", os.path.join(output_dir, ".yt-dlp-archive.txt"),
+                "--no-overwrites",
+                "-o", output_template
             ]
 
-            if use_cookies and os.path.exists(cookies_file):
-                cmd.extend(["--cookies", cookies_file])
+            cookie_args = ["--cookies", cookies_file] if use_cookies else []
 
+            # 还没有下载记录（新目录或旧版本生成的输出目录）时，先按文件名模板检查MP3是否已存在；
+            # 有下载记录后由yt-dlp自己跳过已下载的视频，不再多运行一次
+            if not os.path.exists(os.path.join(output_dir, ".yt-dlp-archive.txt")):
+                mp3_file = self._existing_mp3_path(url, output_template, cookie_args)
+                if mp3_file:
+                    self.log(f"MP3已存在，跳过下载: {os.path.basename(mp3_file)}")
+                    return mp3_file
+
+            cmd.extend(cookie_args)
             cmd.append(url)
 
             self.log(f"执行命令: {' '.join(cmd)}")
 
-            self.process = subprocess.Popen(
+            process = subprocess.Popen(
                 cmd,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
-                universal_newlines=True
+                bufsize=0,
+                start_new_session=True  # 独立进程组，停止时连同其子进程一起终止
             )
 
             # 实时输出日志
-            for line in self.process.stdout:
-                if not self.processing:
-                    self.process.terminate()
-                    return None
+            mp3_file = None
+            archived = False
+            for line in self._iter_lines(process):
                 line = line.strip()
-                if line:
-                    self.log(f"  {line}")
+                if not line:
+                    continue
+                # --print 输出的最终文件路径（标记行不显示在日志里）
+                if match := _FILEPATH_RE.match(line):
+                    mp3_file = match.group(1)
+                    continue
+                self.log(f"  {line}")
+                if "has already been recorded in the archive" in line:
+                    archived = True
 
-            self.process.wait()
+            if self.stop_event.is_set():
+                return None
+
+            process.wait()
+
+            # 已在下载记录中：yt-dlp不会输出路径，按文件名模板推算已有的MP3
+            if archived and not mp3_file:
+                mp3_file = self._existing_mp3_path(url, output_template, cookie_args)
+                if mp3_file:
+                    self.log(f"已下载过，跳过: {os.path.basename(mp3_file)}")
+                    return mp3_file
+                if self.stop_event.is_set():
+                    return None
+                self.log("下载记录中已有该视频，但找不到对应的MP3文件（可从 .yt-dlp-archive.txt 中删除该记录后重试）")
+                return None
 
             # 先检查文件是否存在（优先级高于退出码）
             # 因为即使有警告导致退出码非0，文件也可能已经下载成功
-            mp3_files = list(Path(output_dir).glob("*.mp3"))
-            if mp3_files:
-                mp3_file = max(mp3_files, key=lambda p: p.stat().st_mtime)
-                if self.process.returncode != 0:
-                    self.log(f"注意: yt-dlp 返回退出码 {self.process.returncode}，但文件已下载")
-                return str(mp3_file)
+            if mp3_file:
+                if process.returncode != 0:
+                    self.log(f"注意: yt-dlp 返回退出码 {process.returncode}，但文件已下载")
+                return mp3_file
             else:
                 # 文件不存在才报告失败
-                self.log(f"下载失败，退出码: {self.process.returncode}")
-                self.log("找不到下载的MP3文件")
+                self.log(f"下载失败，退出码: {process.returncode}")
+                # 不再扫描输出目录猜测文件：并发下载到同一目录时可能拿到别的视频
+                self.log("找不到下载的MP3文件（yt-dlp 版本过旧时不会输出文件路径，请先升级: brew upgrade yt-dlp）")
                 return None
 
         except Exception as e:
             self.log(f"下载出错: {str(e)}")
             return None
 
-    def generate_subtitle(self, mp3_file, whisper_bin, whisper_model):
-        """生成字幕"""
+    def _iter_lines(self, process):
+        """逐行读取子进程输出，停止处理时立即终止子进程
+
+        共享的读取线程只负责 os.read 并把原始字节放入该进程自己的队列，
+        解码和分行在这里（调用方线程）完成，读取线程不会被某个进程的大量输出拖慢。
+        读取期间子进程登记在 self.processes 中，供 stop_processing 终止。
+        """
+        self.processes.add(process)
         try:
-            srt_file = f"{mp3_file}.srt"
+            chunks = queue.SimpleQueue()
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+            pending = ""
+            self._watch_output(process.stdout, chunks)
+            while True:
+                if self.stop_event.is_set():
+                    terminate_process(process)
+                    return
+                # 短超时等待，不必等到下一块输出就能响应停止
+                try:
+                    chunk = chunks.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if chunk is None:
+                    # 管道关闭：交出最后一行不带换行符的内容
+                    pending += decoder.decode(b"", final=True)
+                    if pending:
+                        yield pending
+                    return
+                pending += decoder.decode(chunk)
+                *lines, pending = _NEWLINE_RE.split(pending)
+                yield from lines
+        finally:
+            self.processes.discard(process)
+
+    def _watch_output(self, pipe, chunks):
+        """把子进程输出管道登记到共享selector，读到的原始字节放入 chunks，结束时放入None"""
+        os.set_blocking(pipe.fileno(), False)
+        with self._reader_lock:
+            self._selector.register(pipe, selectors.EVENT_READ, data=chunks)
+            if self._reader_thread is None:
+                self._reader_thread = threading.Thread(target=self._reader_loop, daemon=True)
+                self._reader_thread.start()
+                return
+        # 读取线程可能正阻塞在select上，唤醒它以便监听新登记的管道
+        try:
+            os.write(self._reader_wakeup[1], b"\0")
+        except BlockingIOError:
+            # 管道已满，说明已有未处理的唤醒
+            pass
 
-            # 检查字幕是否已存在
-            if os.path.exists(srt_file) and os.path.getsize(srt_file) > 0:
-                self.log(f"字幕已存在，跳过: {os.path.basename(srt_file)}")
-                return srt_file
+    def _reader_loop(self):
+        """共享读取线程：同时读取所有已登记的子进程输出，没有登记的管道时退出"""
+        while True:
+            with self._reader_lock:
+                # 只剩自唤醒管道
+                if len(self._selector.get_map()) <= 1:
+                    self._reader_thread = None
+                    return
+
+            for key, _ in self._selector.select():
+                if key.data is None:
+                    # 自唤醒：清空管道后重新select，新登记的管道随之生效
+                    try:
+                        os.read(key.fd, _READ_CHUNK_SIZE)
+                    except BlockingIOError:
+                        pass
+                    continue
+                try:
+                    chunk = os.read(key.fd, _READ_CHUNK_SIZE)
+                except BlockingIOError:
+                    continue
+                except OSError:
+                    chunk = b""
 
-            cmd = [
-                whisper_bin,
-                "-m", whisper_model,
-                "-f", mp3_file,
-                "-l", "zh",
-                "-osrt",
-                "-t", "16",
-                "-p", "1"
-            ]
+                if chunk:
+                    key.data.put(chunk)
+                    continue
 
-            self.log(f"执行命令: {' '.join(cmd)}")
+                # 管道关闭：取消登记并通知读取方结束
+                with self._reader_lock:
+                    self._selector.unregister(key.fileobj)
+                key.data.put(None)
 
-            self.process = subprocess.Popen(
-                cmd,
+    def _existing_mp3_path(self, url, output_template, cookie_args):
+        """按文件名模板推算视频对应的MP3路径（不下载），文件不存在、为空或无法推算时返回None
+
+        推算需要联网解析视频信息：登记到 self.processes 以便停止时终止，最多等待15秒。
+        """
+        try:
+            process = subprocess.Popen(
+                [self.yt_dlp_path, "--print", "filename", "-o", output_template, *cookie_args, url],
                 stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                universal_newlines=True,
-                cwd=os.path.dirname(mp3_file)
+                stderr=subprocess.DEVNULL,
+                start_new_session=True
             )
+        except OSError:
+            return None
+        self.processes.add(process)
+        try:
+            stdout, _ = process.communicate(timeout=15)
+        except subprocess.TimeoutExpired:
+            terminate_process(process)
+            process.communicate()
+            self.log("注意: 获取视频文件名超时")
+            return None
+        finally:
+            self.processes.discard(process)
 
-            # 实时输出日志
-            for line in self.process.stdout:
-                if not self.processing:
-                    self.process.terminate()
-                    return None
-                line = line.strip()
-                if line:
-                    # 提取进度信息
-                    if "whisper_print_progress" in line or "[" in line:
-                        self.log(f"  {line}")
+        lines = stdout.decode('utf-8', 'replace').strip().splitlines()
+        if process.returncode != 0 or not lines:
+            return None
 
-            self.process.wait()
+        # 打印的是原始音频的文件名，提取音频后扩展名为.mp3
+        mp3_file = os.path.splitext(lines[-1])[0] + ".mp3"
+        return mp3_file if nonempty_file(mp3_file) else None
 
-            if self.process.returncode != 0:
-                self.log(f"字幕生成失败，退出码: {self.process.returncode}")
-                return None
+    def generate_subtitle(self, mp3_file, whisper_bin, whisper_model, threads=None, on_progress=None,
+                          decoded=None):
+        """生成字幕（threads 默认使用全部物理核心，on_progress(百分比) 接收转写进度）
 
-            if os.path.exists(srt_file) and os.path.getsize(srt_file) > 0:
-                return srt_file
-            else:
-                self.log("字幕文件未生成")
-                return None
+        逐个到达的下载文件优先交给常驻的 whisper-server，避免每个文件重新加载模型。
+        decoded 是下载阶段预先解码好的 (WAV路径, 裁掉的开头秒数)，用完后删除WAV。
+        """
+        try:
+            return self.generate_subtitles([mp3_file], whisper_bin, whisper_model, threads, on_progress,
+                                           use_server=True, decoded={mp3_file: decoded} if decoded else None)[mp3_file]
+        finally:
+            if decoded:
+                try:
+                    os.remove(decoded[0])
+                except FileNotFoundError:
+                    # 转写过程中已经删除
+                    pass
+
+    def generate_subtitles(self, mp3_files, whisper_bin, whisper_model, threads=None, on_progress=None,
+                           use_server=False, decoded=None):
+        """为一组MP3生成字幕，返回 {mp3_file: srt_file}，失败的文件对应None
+
+        已有字幕或命中缓存的文件直接跳过，其余文件合并到一次whisper-cli调用中。
+        decoded 为 {mp3_file: (已解码的WAV, 裁掉的开头秒数)}，这些文件不再重复解码。
+        """
+        results = {}
+        pending = []  # 需要转写的 (mp3_file, cache_file)
+        try:
+            for mp3_file in mp3_files:
+                srt_file = f"{mp3_file}.srt"
+
+                # 检查字幕是否已存在
+                if nonempty_file(srt_file):
+                    self.log(f"字幕已存在，跳过: {os.path.basename(srt_file)}")
+                    results[mp3_file] = srt_file
+                    continue
+
+                # 相同内容的音频之前转写过，直接使用缓存
+                cache_file = SUBTITLE_CACHE_DIR / f"{subtitle_cache_key(mp3_file, whisper_model)}.srt"
+                if nonempty_file(cache_file):
+                    # 先复制到临时文件再改名，中途失败不会留下不完整的字幕
+                    shutil.copyfile(cache_file, f"{srt_file}.part")
+                    os.replace(f"{srt_file}.part", srt_file)
+                    self.log(f"使用缓存字幕: {os.path.basename(srt_file)}")
+                    results[mp3_file] = srt_file
+                    continue
+
+                pending.append((mp3_file, cache_file))
+
+            if pending:
+                self._transcribe(pending, whisper_bin, whisper_model,
+                                 threads or physical_cpu_count(), on_progress, results,
+                                 use_server, decoded)
 
         except Exception as e:
             self.log(f"生成字幕出错: {str(e)}")
+
+        return {mp3_file: results.get(mp3_file) for mp3_file in mp3_files}
+
+    def _transcribe(self, pending, whisper_bin, whisper_model, threads, on_progress, results,
+                    use_server=False, decoded=None):
+        """用一次whisper-cli调用转写 pending 中的所有文件，生成的字幕写入 results
+
+        use_server 时单个文件先提交给 whisper-server，服务不可用时再运行whisper-cli。
+        """
+        # whisper-cli 先写入 {mp3_file}.part.srt，成功后再改名，
+        # 中途被终止时不会留下被当作"已存在"而跳过的不完整字幕
+        part_bases = [f"{mp3_file}.part" for mp3_file, _ in pending]
+
+        # 预先用ffmpeg解码为whisper所需的16kHz单声道WAV（裁掉首尾静音），解码失败时直接交给whisper-cli
+        decoded_audio = []  # 每个文件的 (WAV路径, 裁掉的开头秒数)，解码失败时为None
+        try:
+            for mp3_file, _ in pending:
+                if self.stop_event.is_set():
+                    break
+                decoded_audio.append((decoded or {}).get(mp3_file) or self._decode_audio(mp3_file))
+
+            # whisper-server 只接受解码好的WAV
+            served = False
+            if use_server and len(pending) == 1 and decoded_audio and decoded_audio[0]:
+                server_url = self._whisper_server(whisper_bin, whisper_model)
+                served = bool(server_url) and self._run_whisper_server(
+                    server_url, decoded_audio[0][0], f"{part_bases[0]}.srt", on_progress)
+
+            if not served and not self.stop_event.is_set():
+                audio_files = [audio[0] if audio else mp3_file
+                               for audio, (mp3_file, _) in zip(decoded_audio, pending)]
+                batch_ok = self._run_whisper(audio_files, part_bases, whisper_bin, whisper_model,
+                                             threads, on_progress)
+
+                # 旧版whisper-cli只认最后一个 -of（或批量中途失败），缺少字幕的文件逐个重新转写；
+                # 失败且一个字幕都没有生成时（模型损坏、参数不被支持等）逐个重试也只会同样失败
+                missing = [(audio_file, part_base) for audio_file, part_base in zip(audio_files, part_bases)
+                           if not nonempty_file(f"{part_base}.srt")]
+                if len(audio_files) > 1 and missing and not self.stop_event.is_set():
+                    if not batch_ok and len(missing) == len(audio_files):
+                        self.log(f"✗ 批量转写失败，{len(missing)} 个文件均未生成字幕")
+                    else:
+                        self.log(f"注意: 批量转写有 {len(missing)} 个文件未生成字幕，改为逐个转写")
+                        for audio_file, part_base in missing:
+                            if self.stop_event.is_set():
+                                break
+                            self._run_whisper([audio_file], [part_base], whisper_bin, whisper_model,
+                                              threads, on_progress)
+        finally:
+            for audio in decoded_audio:
+                if audio:
+                    os.remove(audio[0])
+
+        offsets = {mp3_file: audio[1] for audio, (mp3_file, _) in zip(decoded_audio, pending) if audio}
+        for (mp3_file, cache_file), part_base in zip(pending, part_bases):
+            part_srt = f"{part_base}.srt"
+            # 停止时正在写入的字幕可能不完整，全部丢弃
+            if self.stop_event.is_set() or not nonempty_file(part_srt):
+                try:
+                    os.remove(part_srt)
+                except FileNotFoundError:
+                    pass
+                if not self.stop_event.is_set():
+                    self.log(f"字幕文件未生成: {os.path.basename(mp3_file)}")
+                continue
+
+            # 转写的是裁掉开头静音后的音频，时间戳需要加回裁掉的时长
+            offset = offsets.get(mp3_file)
+            if offset:
+                with open(part_srt, encoding='utf-8', errors='replace') as f:
+                    srt = f.read()
+                with open(part_srt, 'w', encoding='utf-8') as f:
+                    f.write(shift_srt_timestamps(srt, offset))
+
+            srt_file = f"{mp3_file}.srt"
+            os.replace(part_srt, srt_file)
+            results[mp3_file] = srt_file
+            try:
+                SUBTITLE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                fd, cache_part = tempfile.mkstemp(dir=SUBTITLE_CACHE_DIR, suffix=".part")
+                os.close(fd)
+                shutil.copyfile(srt_file, cache_part)
+                os.replace(cache_part, cache_file)
+            except OSError as e:
+                self.log(f"注意: 无法写入字幕缓存: {str(e)}")
+
+    def _decode_audio(self, mp3_file):
+        """用ffmpeg把音频解码为16kHz单声道WAV临时文件，返回 (WAV路径, 裁掉的开头秒数)，失败时返回None
+
+        解码的同时用 silencedetect 找出首尾静音并裁掉，whisper 不必对这部分音频做编码。
+        """
+        fd, wav_file = tempfile.mkstemp(prefix="whisper-", suffix=".wav")
+        os.close(fd)
+
+        cmd = [
+            self.ffmpeg_path,
+            "-nostdin", "-y", "-hide_banner", "-nostats",
+            # silencedetect 的结果在info级别输出，带上级别前缀以便只把错误显示到日志
+            "-loglevel", "repeat+level+info",
+            "-i", mp3_file,
+            "-af", f"silencedetect=noise={SILENCE_THRESHOLD_DB}dB:duration={SILENCE_MIN_DURATION}",
+            "-ar", "16000",
+            "-ac", "1",
+            "-c:a", "pcm_s16le",
+            wav_file
+        ]
+        silences = []  # [(静音开始, 静音结束或None)]
+
+        try:
+            process = subprocess.Popen(
+                cmd,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                bufsize=0,
+                start_new_session=True  # 独立进程组，停止时连同其子进程一起终止
+            )
+            for line in self._iter_lines(process):
+                match = _SILENCE_RE.search(line)
+                if match:
+                    kind, seconds = match.group(1), float(match.group(2))
+                    if kind == "start":
+                        silences.append((seconds, None))
+                    elif silences:
+                        silences[-1] = (silences[-1][0], seconds)
+                elif _FFMPEG_ERROR_RE.search(line):
+                    self.log(f"  {line.strip()}")
+
+            if not self.stop_event.is_set() and process.wait() == 0:
+                return wav_file, self._trim_silence(wav_file, silences)
+            if not self.stop_event.is_set():
+                self.log(f"注意: ffmpeg 解码失败，退出码 {process.returncode}，直接使用MP3")
+        except OSError as e:
+            self.log(f"注意: 无法运行ffmpeg ({str(e)})，直接使用MP3")
+
+        os.remove(wav_file)
+        return None
+
+    def _trim_silence(self, wav_file, silences):
+        """按 silencedetect 的结果就地裁掉WAV首尾的静音，返回裁掉的开头秒数
+
+        在原文件中用mmap把保留的音频前移并截断，不再另写一份WAV；只裁结尾时无需移动数据。
+        """
+        try:
+            with wave.open(wav_file, 'rb') as reader:
+                rate = reader.getframerate()
+                frame_size = reader.getsampwidth() * reader.getnchannels()
+                duration = reader.getnframes() / rate
+            trim = silence_trim_range(silences, duration)
+            if not trim:
+                return 0
+            start_frame, end_frame = (int(seconds * rate) for seconds in trim)
+            length = (end_frame - start_frame) * frame_size
+
+            with open(wav_file, 'r+b') as f:
+                with mmap.mmap(f.fileno(), 0) as data:
+                    data_offset = wav_data_offset(data)
+                    if start_frame:
+                        data.move(data_offset, data_offset + start_frame * frame_size, length)
+                    # 更新 data 块和 RIFF 文件头中的长度
+                    struct.pack_into('<I', data, data_offset - 4, length)
+                    struct.pack_into('<I', data, 4, data_offset + length - 8)
+                f.truncate(data_offset + length)
+        except (OSError, ValueError, EOFError, struct.error, wave.Error) as e:
+            self.log(f"注意: 裁剪静音失败 ({str(e)})，使用完整音频")
+            return 0
+
+        offset = start_frame / rate
+        self.log(f"裁掉首尾静音 {duration - (end_frame - start_frame) / rate:.1f} 秒（开头 {offset:.1f} 秒）")
+        return offset
+
+    def _run_whisper(self, audio_files, output_bases, whisper_bin, whisper_model, threads, on_progress):
+        """运行一次whisper-cli转写多个文件，第i个文件的字幕写入 {output_bases[i]}.srt，成功返回True"""
+        inputs = []
+        for audio_file, output_base in zip(audio_files, output_bases):
+            # 输出文件名不带.srt后缀
+            inputs += ["-f", audio_file, "-of", output_base]
+
+        cmd = [
+            whisper_bin,
+            "-m", whisper_model,
+            *inputs,
+            "-l", "zh",
+            "-osrt",
+            "-t", str(threads),
+            "-p", "1",
+            "-bs", "1",  # 贪心解码，批量转写时吞吐量优先
+            "-bo", "1",
+            "-pp",  # 输出进度，用于驱动进度条
+            *whisper_accel_args(whisper_bin)
+        ]
+
+        self.log(f"执行命令: {' '.join(cmd)}")
+
+        process = subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            bufsize=0,
+            cwd=os.path.dirname(output_bases[0]),
+            start_new_session=True
+        )
+
+        # 实时输出日志
+        if on_progress:
+            on_progress(0)
+        # 每个文件开始时whisper-cli输出一次音频时长，据此知道正在转写第几个文件
+        durations = []
+        total_time = None
+        percent = 0
+        for line in self._iter_lines(process):
+            line = line.strip()
+            if line:
+                # 提取进度信息：-pp 的百分比只按5%步进，字幕片段的结束时间可以细化进度
+                file_percent = None
+                log_line = _LOG_FILTER(line)
+                match = _PROG_RE.search(line)
+                if match:
+                    file_percent = int(match.group(1))
+                    log_line = file_percent % _LOG_PROGRESS_STEP == 0
+                elif match := _TS_RE.search(line):
+                    if durations:
+                        file_percent = min(99, int(parse_timestamp(match.group(2)) * 100 / durations[-1]))
+                elif match := _DURATION_RE.search(line):
+                    durations.append(float(match.group(1)))
+                    # 批量转写时标出当前文件（输入可能是临时WAV，用输出文件名显示）
+                    if len(audio_files) > 1 and len(durations) <= len(output_bases):
+                        name = os.path.splitext(os.path.basename(output_bases[len(durations) - 1]))[0]
+                        self.log(f"  转写 ({len(durations)}/{len(audio_files)}): {name}")
+                elif match := _RTF_RE.search(line):
+                    total_time = float(match.group(1)) / 1000
+                elif "system_info:" in line and not self._accel_checked:
+                    # 纯CPU编译的whisper-cli比Metal/BLAS版本慢数倍，第一次转写时提示一次
+                    self._accel_checked = True
+                    if not _ACCEL_RE.search(line):
+                        self.log("提示: 当前whisper-cli未启用Metal/CUDA/BLAS加速，"
+                                 "按README重新编译可以快数倍")
+
+                # 整体进度 = 已完成文件 + 当前文件的进度
+                if file_percent is not None and durations:
+                    overall = ((len(durations) - 1) * 100 + file_percent) // len(audio_files)
+                    if overall > percent:
+                        percent = overall
+                        if on_progress:
+                            on_progress(percent)
+
+                if log_line:
+                    self.log(f"  {line}")
+
+        if self.stop_event.is_set():
+            return False
+
+        process.wait()
+
+        if process.returncode != 0:
+            self.log(f"字幕生成失败，退出码: {process.returncode}")
+            return False
+
+        if on_progress:
+            on_progress(100)
+        duration = sum(durations)
+        if duration and total_time:
+            self.log(f"音频 {duration:.1f} 秒，耗时 {total_time:.1f} 秒，实时率 RTF {total_time / duration:.3f}")
+        return True
+
+    def _whisper_server(self, whisper_bin, whisper_model):
+        """返回已就绪的 whisper-server 地址，没有 whisper-server 程序或启动失败时返回None"""
+        server_bin = os.path.join(os.path.dirname(whisper_bin), "whisper-server")
+        if not os.path.isfile(server_bin):
             return None
 
+        if (self._server_process and self._server_process.poll() is None
+                and self._server_key == (server_bin, whisper_model)):
+            return self._server_url
+        if self._server_failed == (server_bin, whisper_model):
+            return None
+        # 模型改变或服务已退出，重新启动
+        self._stop_whisper_server()
+
+        port = free_local_port()
+        server_url = f"http://127.0.0.1:{port}"
+        cmd = [
+            server_bin,
+            "-m", whisper_model,
+            "--host", "127.0.0.1",
+            "--port", str(port),
+            "-t", str(physical_cpu_count()),
+            "-l", "zh",
+            "-bs", "1",
+            "-bo", "1",
+            # 与whisper-cli相同的加速参数（按whisper-server自己的帮助信息检测）
+            *whisper_accel_args(server_bin)
+        ]
+        self.log(f"启动whisper-server: {' '.join(cmd)}")
+        try:
+            process = subprocess.Popen(
+                cmd,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                start_new_session=True
+            )
+        except OSError as e:
+            self.log(f"注意: 无法启动whisper-server ({str(e)})，使用whisper-cli")
+            return None
+        # 启动期间就登记，关闭窗口时也能终止
+        with self._server_lock:
+            self._server_process = process
+
+        # 等待模型加载完成、端口可以访问
+        deadline = time.monotonic() + 60
+        while process.poll() is None and time.monotonic() < deadline and not self.stop_event.is_set():
+            try:
+                with _LOCAL_OPENER.open(server_url, timeout=1) as response:
+                    page = response.read()
+            except (OSError, http.client.HTTPException):
+                time.sleep(0.2)
+                continue
+            # 端口是先分配后绑定的，确认应答的是我们启动的 whisper-server（按其首页标题判断），
+            # 而不是在这期间占用了该端口的其他程序
+            if process.poll() is not None or _WHISPER_SERVER_TITLE not in page:
+                break
+            self._server_key = (server_bin, whisper_model)
+            self._server_url = server_url
+            return server_url
+
+        self._stop_whisper_server()
+        if not self.stop_event.is_set():
+            self._server_failed = (server_bin, whisper_model)
+            self.log("注意: whisper-server 启动失败，本批次改用whisper-cli")
+        return None
+
+    def _stop_whisper_server(self):
+        """终止常驻的 whisper-server（可在任意线程调用）"""
+        with self._server_lock:
+            process, self._server_process = self._server_process, None
+            self._server_key = self._server_url = None
+        if process:
+            terminate_process(process)
+
+    def _run_whisper_server(self, server_url, audio_file, srt_file, on_progress):
+        """把WAV提交给 whisper-server 转写，字幕写入 srt_file，成功返回True"""
+        body, content_type, length = encode_multipart(
+            {'language': 'zh', 'response_format': 'srt', 'temperature': '0'}, 'file', audio_file)
+        # 请求体是迭代器，必须给出长度，否则 urllib 会改用分块传输
+        request = urllib.request.Request(f"{server_url}/inference", data=body,
+                                         headers={'Content-Type': content_type,
+                                                  'Content-Length': str(length)})
+
+        # 按帧数计算时长：ffmpeg 写入的文件头不止44字节，裁剪静音后文件也被改写过
+        duration = wav_duration(audio_file)
+
+        self.log(f"提交到whisper-server: {server_url}/inference")
+        if on_progress:
+            on_progress(0)
+        started = time.monotonic()
+        self._server_busy = True
+        try:
+            # 服务转写完成后才返回，超时按音频时长放宽，避免服务卡住时字幕线程永远等待
+            with _LOCAL_OPENER.open(request, timeout=120 + duration * 4) as response:
+                srt = response.read()
+        except (OSError, http.client.HTTPException) as e:
+            if not self.stop_event.is_set():
+                if isinstance(getattr(e, 'reason', e), socket.timeout):
+                    # 服务仍在处理这个请求，终止它，避免与whisper-cli争抢CPU
+                    self._stop_whisper_server()
+                self.log(f"注意: whisper-server 请求失败 ({str(e)})，改用whisper-cli")
+            return False
+        finally:
+            self._server_busy = False
+
+        if self.stop_event.is_set():
+            return False
+        # 出错时服务返回JSON格式的错误信息
+        if srt.lstrip().startswith(b'{'):
+            self.log(f"注意: whisper-server 返回错误 ({srt.decode('utf-8', 'replace').strip()})，改用whisper-cli")
+            return False
+
+        with open(srt_file, 'wb') as f:
+            f.write(srt)
+
+        if on_progress:
+            on_progress(100)
+        elapsed = time.monotonic() - started
+        if duration > 0:
+            self.log(f"音频 {duration:.1f} 秒，耗时 {elapsed:.1f} 秒，实时率 RTF {elapsed / duration:.3f}")
+        return True
+
 def main():
     root = tk.Tk()
     app = YouTubeSubtitleGenerator(root)
-    root.mainloop()
+    try:
+        root.mainloop()
+    finally:
+        # Ctrl-C 或未处理的异常退出时也不留下孤立的子进程（whisper-server 会一直占用模型内存）
+        app.shutdown()
 
 if __name__ == "__main__":
     main()